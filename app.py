@@ -1,10 +1,42 @@
 import os
+import re
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Coroutine
+from concurrent.futures import Future
 from flask import Flask, request
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
-from openai import OpenAI  # OpenAI 官方 SDK v1.x
+
+import httpx
+
+try:
+    import ahocorasick  # pyahocorasick：C 實作的多模式比對（可選）
+except ImportError:
+    ahocorasick = None
+from linebot import WebhookParser
+from linebot.models import MessageEvent, TextMessage
+from linebot.v3.messaging import (
+    ApiClient,
+    ApiException,
+    Configuration,
+    MessagingApi,
+    PushMessageRequest,
+    ReplyMessageRequest,
+)
+from linebot.v3.messaging import TextMessage as TextSendMessage
+from openai import (  # OpenAI 官方 SDK v1.x
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from aiolimiter import AsyncLimiter
 
 # -------------------- 基本設定 --------------------
 app = Flask(__name__)
@@ -16,39 +48,134 @@ CHANNEL_SECRET = os.environ.get("LINE_CHANNEL_SECRET", "").strip()
 if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
     raise RuntimeError("缺少 LINE 環境變數：LINE_CHANNEL_ACCESS_TOKEN / LINE_CHANNEL_SECRET")
 
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(CHANNEL_SECRET)
+# v3 messaging client：全 process 共用一個 ApiClient（urllib3 連線池），
+# 回覆走 keep-alive 連線，不再每次 reply 重付 TLS 握手
+configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN)
+api_client = ApiClient(configuration, pool_threads=16)
+line_bot_api = MessagingApi(api_client)
+parser = WebhookParser(CHANNEL_SECRET)
+
+# webhook body 的 json.loads 改走 orjson（Rust/SIMD 解析，比 stdlib 快 2–5 倍）；
+# parse() 只用到 loads，介面相容，未安裝 orjson 就維持 stdlib
+try:
+    import orjson
+
+    import linebot.webhook as _linebot_webhook
+    _linebot_webhook.json = orjson
+except ImportError:
+    pass
+
+# 驗簽自己做：金鑰 bytes 預先算好、HMAC 直接跑在 raw body 上（OpenSSL C 路徑，
+# 省掉 SDK 每次 decode→re-encode 的字串往返），比對用 compare_digest 恆定時間
+_CHANNEL_SECRET_BYTES = CHANNEL_SECRET.encode("utf-8")
 
-# OpenAI
+def _signature_ok(body: bytes, signature: str) -> bool:
+    digest = hmac.new(_CHANNEL_SECRET_BYTES, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
+class _PrevalidatedSignature:
+    """callback 已對 raw bytes 驗過簽章，parse() 內不再重算一次 HMAC。"""
+    def validate(self, body: str, signature: str) -> bool:
+        return True
+
+parser.signature_validator = _PrevalidatedSignature()
+
+# OpenAI（async client：await 期間釋放 worker，不再被 HTTPS 往返卡住）
+# 自帶 httpx 連線池：HTTP/2 + 大 keep-alive，省去併發下重複的 TLS 握手
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+    timeout=20.0,
+)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_http_client) if OPENAI_API_KEY else None
 
 # 模型可用環境變數控制（預設 gpt-4o，失敗退 gpt-4o-mini）
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o").strip()
 OPENAI_FALLBACK_MODEL = os.environ.get("OPENAI_FALLBACK_MODEL", "gpt-4o-mini").strip()
 
+# 出手前先在本地端限流（token bucket，每模型一個），不要靠 429 重試硬扛；0 = 不限
+OPENAI_RPM = int(os.environ.get("OPENAI_RPM", "0") or 0)
+_rate_limiters: dict[str, AsyncLimiter] = {}
+
+def _rate_limiter(model: str) -> AsyncLimiter:
+    lim = _rate_limiters.get(model)
+    if lim is None:
+        lim = _rate_limiters.setdefault(model, AsyncLimiter(OPENAI_RPM, 60))
+    return lim
+
 # -------------------- 讀取 System Prompt（支援分段） --------------------
 def load_system_prompt() -> str:
     txt = (os.environ.get("SYSTEM_PROMPT", "") or "").strip()
     if txt:
         return txt
-    parts = []
-    i = 1
-    while True:
-        seg = (os.environ.get(f"SYSTEM_PROMPT_P{i}", "") or "").strip()
-        if not seg:
-            break
-        parts.append(seg)
-        i += 1
+    # 單趟掃描 os.environ 取代逐號 get 的試探迴圈（冷啟動較快），
+    # 依編號排序串接，缺號也不會像舊寫法那樣提前截斷
+    prefix = "SYSTEM_PROMPT_P"
+    numbered = sorted(
+        (int(k[len(prefix):]), v.strip())
+        for k, v in os.environ.items()
+        if k.startswith(prefix) and k[len(prefix):].isdigit()
+    )
+    parts = [seg for _i, seg in numbered if seg]
     if parts:
         return "\n".join(parts)
     # 後備：若未設定，給極簡預設
     return "你是一位溫柔且堅定的中文陪聊者。回覆要短、同理、具體；不提供醫療診斷。"
 
 SYSTEM_PROMPT = load_system_prompt()
+_SYSTEM_PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()
+
+# system message 固定一份、永遠放 messages 開頭且不插入任何使用者資料：
+# 前綴逐 byte 不變，OpenAI 端的 prompt cache（≥1024 token 前綴）才吃得到
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# -------------------- 回覆快取 --------------------
+# 重複訊息（「你好」「hi」、貼圖 fallback 文字…）直接回快取，省一趟 HTTPS 與費用。
+# key 含模型與 system prompt hash，換模型或改 prompt 即自然失效。
+REPLY_CACHE_SIZE = 4096
+_reply_cache: OrderedDict[tuple[str, str, str], str] = OrderedDict()
+
+def _cache_get(key: tuple[str, str, str]) -> str | None:
+    val = _reply_cache.get(key)
+    if val is not None:
+        _reply_cache.move_to_end(key)
+    return val
+
+def _cache_put(key: tuple[str, str, str], val: str) -> None:
+    _reply_cache[key] = val
+    _reply_cache.move_to_end(key)
+    if len(_reply_cache) > REPLY_CACHE_SIZE:
+        _reply_cache.popitem(last=False)
 
 # -------------------- 危機偵測 --------------------
 CRISIS_WORDS = ["自殺", "想死", "不想活", "輕生", "自我了斷", "割腕", "跳樓", "傷害自己"]
+
+# 比對前先正規化：一次 C-level translate 掃掉字間塞入的空白／零寬字元與常見標點
+# （「自 殺」「自.殺」「自·殺」），再 casefold 以涵蓋日後加入的拉丁字詞（kms / suicide）；
+# 詞表在建表時就先摺疊好，請求路徑上只多一次 translate＋casefold，不必逐詞重複處理。
+# 標點只從摺疊副本移除、不動原文，句界誤併只可能多觸發危機掃描——寧可誤報也不漏報
+_STRIP_TABLE = str.maketrans("", "", " \t\r\n.,\u00b7\uff0e\u3002\uff0c\u3000\u200b\u200c\u200d\u2060\ufeff")
+
+def _fold(text: str) -> str:
+    return text.translate(_STRIP_TABLE).casefold()
+
+# 以摺疊後的 CRISIS_WORDS 建一次 Aho–Corasick 自動機（單趟 C-level 掃描，取代逐詞 in 迴圈）；
+# 未安裝 pyahocorasick 時退回預編譯的 re 交替式（同樣是單次 C 呼叫）
+if ahocorasick is not None:
+    CRISIS_AC = ahocorasick.Automaton()
+    for _w in CRISIS_WORDS:
+        _fw = _fold(_w)
+        CRISIS_AC.add_word(_fw, _fw)
+    CRISIS_AC.make_automaton()
+
+    def is_crisis(text: str) -> bool:
+        return next(CRISIS_AC.iter(_fold(text)), None) is not None
+else:
+    CRISIS_RE = re.compile("|".join(re.escape(_fold(w)) for w in CRISIS_WORDS))
+
+    def is_crisis(text: str) -> bool:
+        return CRISIS_RE.search(_fold(text)) is not None
 CRISIS_REPLY = (
     "⚠️ 我很在乎你的安全，也謝謝你願意說出來。\n"
     "若你有立即危險，請立刻撥打 110 / 119。\n"
@@ -56,13 +183,19 @@ CRISIS_REPLY = (
     "如果你願意，也可以告訴我：此刻最讓你難受的是什麼？我會在這裡陪你。"
 )
 
+# GPT 生成期間先用 reply token 回的占位訊息（正式回覆之後用 push 補上）
+THINKING_REPLY = "我在想怎麼回覆你，稍等我一下喔…"
+
+# 兩個模型都失敗時的最後回覆
+ERROR_REPLY = "抱歉，我這邊暫時遇到問題，但我仍在這裡。願意多說一點發生了什麼嗎？"
+
 # -------------------- 健康檢查與首頁 --------------------
 @app.get("/health")
-def health():
+def health() -> tuple[str, int]:
     return "ok", 200
 
 @app.get("/")
-def index():
+def index() -> tuple[str, int, dict[str, str]]:
     return (
         "<h3>LINE bot is running.</h3>"
         "<p>/health → ok ・ /callback ← LINE Webhook</p>",
@@ -71,97 +204,297 @@ def index():
     )
 
 # -------------------- 呼叫 OpenAI --------------------
-def ask_gpt(user_text: str) -> str:
-    if not client:
-        return f"（尚未設定 OPENAI_API_KEY）你剛剛說：{user_text}"
+# 暫時性錯誤（429 / 5xx / 逾時 / 連線）先指數退避＋抖動重試，重試用盡才換 fallback 模型，
+# 避免一次 429 就白付一趟完整的備援呼叫
+TRANSIENT_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+# 生成時間與輸出 token 數近乎線性：溫度可由環境變數下調（0 = 確定性、解碼也略快）
+OPENAI_TEMPERATURE = float(os.environ.get("OPENAI_TEMPERATURE", "0.7") or 0.7)
+
+# 跨請求不變的參數建一次就好，不要每次呼叫都重組 dict（model / max_tokens 會變，留在呼叫點）
+# user 給穩定值（prompt hash）：OpenAI 以 prefix+user 做 prompt cache 分片路由，
+# 固定值讓請求持續落在暖的 cache shard
+BASE_CHAT_KWARGS = dict(
+    temperature=OPENAI_TEMPERATURE,
+    timeout=20,  # 逾時保護
+    stream=True,
+    user=_SYSTEM_PROMPT_HASH,
+)
+
+def _max_tokens(user_text: str) -> int:
+    # 依輸入長度調上限：短訊息不需要 400 token 的回覆，砍掉多餘解碼步數就是砍延遲
+    return min(400, 64 + 2 * len(user_text))
+
+@retry(
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def _chat(model: str, user_text: str, max_tokens: int = 400) -> str:
+    assert client is not None  # ask_gpt 入口已擋掉未設 OPENAI_API_KEY 的情況
+    if OPENAI_RPM:
+        await _rate_limiter(model).acquire()
+    # stream=True：邊生成邊收 chunk，首字約 100ms 就到，不用等整段 400 token 生完
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=[
+            SYSTEM_MSG,
+            {"role": "user", "content": user_text},
+        ],
+        max_tokens=max_tokens,
+        **BASE_CHAT_KWARGS,
+    )
+    parts = []
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+    return "".join(parts).strip()
 
+async def _ask_single(user_text: str) -> str:
+    max_tok = _max_tokens(user_text)
     try:
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_text},
-            ],
-            temperature=0.7,
-            max_tokens=400,
-            timeout=20,  # 逾時保護
-        )
-        return (resp.choices[0].message.content or "").strip()
+        reply = await _chat(OPENAI_MODEL, user_text, max_tokens=max_tok)
+        if reply:  # 空回覆別進快取：LINE 拒收空訊息，快取只會把這則輸入釘死在 400
+            _cache_put((OPENAI_MODEL, _SYSTEM_PROMPT_HASH, user_text), reply)
+        return reply
     except Exception as e:
         app.logger.error(f"[openai primary {OPENAI_MODEL}] {e}; fallback to {OPENAI_FALLBACK_MODEL}")
         try:
-            resp = client.chat.completions.create(
-                model=OPENAI_FALLBACK_MODEL,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_text},
-                ],
-                temperature=0.7,
-                max_tokens=400,
-                timeout=20,
-            )
-            return (resp.choices[0].message.content or "").strip()
+            return await _chat(OPENAI_FALLBACK_MODEL, user_text, max_tokens=max_tok)
         except Exception as e2:
             app.logger.error(f"[openai fallback {OPENAI_FALLBACK_MODEL}] {e2}")
-            return "抱歉，我這邊暫時遇到問題，但我仍在這裡。願意多說一點發生了什麼嗎？"
+            return ERROR_REPLY
+
+# -------------------- 微批次 --------------------
+# 同一視窗（預設 50ms）內抵達的多則訊息合併成一次 OpenAI 請求：
+# 編號多工送出、按標記拆回，攤平每請求 HTTP 開銷並節省 RPM 配額；視窗設 0 即關閉
+BATCH_WINDOW_MS = int(os.environ.get("OPENAI_BATCH_WINDOW_MS", "50") or 0)
+BATCH_MAX = int(os.environ.get("OPENAI_BATCH_MAX", "8"))
+
+_batch_queue: asyncio.Queue = asyncio.Queue()
+
+_BATCH_PROMPT = (
+    "以下是多位互不相識使用者各自獨立的訊息，請依系統指示分別回覆每一位。\n"
+    "輸出格式：每則回覆前單獨一行標記「###<編號>###」，除回覆內容外不要有其他文字。\n\n"
+)
+_BATCH_SPLIT_RE = re.compile(r"###\s*(\d+)\s*###")
+
+def _parse_batch_reply(text: str, n: int) -> dict[int, str]:
+    parts = _BATCH_SPLIT_RE.split(text)
+    replies = {}
+    for i in range(1, len(parts) - 1, 2):
+        idx = int(parts[i])
+        if 1 <= idx <= n and parts[i + 1].strip():
+            replies[idx] = parts[i + 1].strip()
+    return replies
+
+def _set_reply(fut: asyncio.Future, reply: str) -> None:
+    if not fut.done():
+        fut.set_result(reply)
+
+async def _resolve_single(text: str, fut: asyncio.Future) -> None:
+    _set_reply(fut, await _ask_single(text))
+
+async def _run_batch(batch: list[tuple[str, asyncio.Future]]) -> None:
+    try:
+        if len(batch) == 1:
+            await _resolve_single(*batch[0])
+            return
+
+        # 使用者文字先拔掉任何 ###<n>### 標記：不然一則訊息就能偽造別人的
+        # 槽位，讓模型輸出被拆錯、把內容塞進別的使用者的回覆
+        prompt = _BATCH_PROMPT + "\n".join(
+            f"###{i}###\n{_BATCH_SPLIT_RE.sub('', text)}" for i, (text, _fut) in enumerate(batch, 1)
+        )
+        replies: dict[int, str] = {}
+        try:
+            raw = await _chat(OPENAI_MODEL, prompt, max_tokens=sum(_max_tokens(t) for t, _fut in batch))
+            replies = _parse_batch_reply(raw, len(batch))
+        except Exception as e:
+            app.logger.error(f"[openai batch x{len(batch)}] {e}; falling back to single calls")
+
+        # 缺漏或拆不出來的項目「並發」退回單發：一批壞掉不該付串行 N 趟的代價
+        pending = []
+        for i, (text, fut) in enumerate(batch, 1):
+            reply = replies.get(i)
+            if reply:
+                _cache_put((OPENAI_MODEL, _SYSTEM_PROMPT_HASH, text), reply)
+                _set_reply(fut, reply)
+            else:
+                pending.append((text, fut))
+        if pending:
+            await asyncio.gather(*(_resolve_single(t, f) for t, f in pending))
+    except Exception as e:
+        # 任何沒預期到的失敗都要把 future 解掉，否則 ask_gpt 會永遠卡在 await
+        app.logger.error(f"[batch] {e}")
+        for _text, fut in batch:
+            _set_reply(fut, ERROR_REPLY)
+
+async def _batch_worker() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_MS / 1000
+        while len(batch) < BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 每批開成獨立 task：collector 立刻回去收下一批，
+        # 不讓單一 OpenAI 往返（1–20s）擋住整條佇列
+        task = asyncio.ensure_future(_run_batch(batch))
+        task.add_done_callback(_log_bg_error)
+
+async def ask_gpt(user_text: str) -> str:
+    if not client:
+        return f"（尚未設定 OPENAI_API_KEY）你剛剛說：{user_text}"
+
+    cached = _cache_get((OPENAI_MODEL, _SYSTEM_PROMPT_HASH, user_text))
+    if cached is not None:
+        return cached
+
+    if not BATCH_WINDOW_MS:
+        return await _ask_single(user_text)
+
+    fut = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((user_text, fut))
+    return await fut
+
+# -------------------- 背景事件迴圈 --------------------
+# /callback 只做驗簽＋解析後立刻回 200（LINE 逾時會重送 webhook），
+# GPT 與回覆都丟到這顆常駐 loop 上跑；in-flight coroutine 數就是併發上限。
+# loop 實作：有 uvloop 就用，否則內建 asyncio。
+# 註：uringcore（io_uring）試過但不可用——其 loop 缺 get_task_factory，
+# anyio/httpcore 開連線時就炸，所有 OpenAI 呼叫會連續重試後落到罐頭道歉；
+# 問題發生在請求期而非 import 期，try/except 擋不到，故整個不納入選擇鏈
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+_bg_loop = asyncio.new_event_loop()
+threading.Thread(target=_bg_loop.run_forever, name="line-bot-bg", daemon=True).start()
+
+def _log_bg_error(fut: Future) -> None:
+    exc = fut.exception()
+    if exc:
+        app.logger.error(f"[bg] {exc}")
+
+def dispatch(coro: Coroutine) -> Future:
+    fut = asyncio.run_coroutine_threadsafe(coro, _bg_loop)
+    fut.add_done_callback(_log_bg_error)
+    return fut
+
+if BATCH_WINDOW_MS:
+    dispatch(_batch_worker())
 
 # -------------------- LINE Webhook --------------------
 @app.post("/callback")
-def callback():
+def callback() -> tuple[str, int]:
     signature = request.headers.get("X-Line-Signature")
-    body = request.get_data(as_text=True)
+    body = request.get_data()  # raw bytes：直接餵 HMAC，不先 decode
     app.logger.info(f"[callback] body_len={len(body)}")
 
     if not signature:
         app.logger.error("[callback] Missing X-Line-Signature")
         return "missing signature", 400
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    if not _signature_ok(body, signature):
         app.logger.error("[callback] Invalid signature（請檢查 LINE_CHANNEL_SECRET）")
         return "invalid signature", 400
 
-    return "OK", 200
-
-# -------------------- 文字訊息處理 --------------------
-@handler.add(MessageEvent, message=TextMessage)
-def on_text(event: MessageEvent):
-    user_text = (event.message.text or "").strip()
+    events = parser.parse(body.decode("utf-8"), signature)
 
-    # 危機優先
-    if any(w in user_text for w in CRISIS_WORDS):
-        reply = TextSendMessage(text=CRISIS_REPLY)
-    else:
-        reply_text = ask_gpt(user_text)
-        reply = TextSendMessage(text=reply_text)
+    for event in events:
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+            dispatch(on_text(event))
 
-    try:
-        line_bot_api.reply_message(event.reply_token, reply)
-    except Exception as e:
-        app.logger.error(f"[line reply] {e}")
+    return "OK", 200
 
-# -------------------- 本機啟動（雲端用 gunicorn） --------------------
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-from linebot.exceptions import LineBotApiError
-from linebot.models import TextSendMessage
+# -------------------- 文字訊息處理 --------------------
+async def _push(user_id: str, text: str) -> None:
+    # LINE SDK 是同步 urllib3，丟到 thread 以免卡住 event loop
+    await asyncio.to_thread(
+        line_bot_api.push_message,
+        PushMessageRequest(to=user_id, messages=[TextSendMessage(text=text)]),
+    )
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_text(event):
-    user_text = (event.message.text or "").strip()
+async def _send_reply(event: MessageEvent, reply_text: str) -> None:
     try:
-        reply_text = ask_gpt(user_text)
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-    except LineBotApiError as e:
-        app.logger.error(f"[line] reply failed status={getattr(e, 'status_code', None)} msg={e.error.message if hasattr(e, 'error') else e}")
+        await asyncio.to_thread(
+            line_bot_api.reply_message,
+            ReplyMessageRequest(reply_token=event.reply_token, messages=[TextSendMessage(text=reply_text)]),
+        )
+    except ApiException as e:
+        app.logger.error(f"[line] reply failed status={getattr(e, 'status', None)} msg={getattr(e, 'body', e)}")
         # 若 reply token 失效（常見 400），改用 push 補發
-        if hasattr(event, "source") and getattr(event.source, "user_id", None):
+        user_id = getattr(event.source, "user_id", None) if hasattr(event, "source") else None
+        if user_id:
             try:
-                line_bot_api.push_message(event.source.user_id, TextSendMessage(text=reply_text))
+                await _push(user_id, reply_text)
                 app.logger.info("[line] fallback push sent")
             except Exception as e2:
                 app.logger.error(f"[line] push failed: {e2}")
         else:
             app.logger.error("[line] no user_id to push")
+    except Exception as e:
+        app.logger.error(f"[line reply] {e}")
+
+async def on_text(event: MessageEvent) -> None:
+    text = event.message.text
+    if not text:
+        return
+    # 多數訊息頭尾本來就沒空白，先用 C-level 邊界檢查避免每則都 strip 出新字串
+    user_text = text.strip() if (text[0].isspace() or text[-1].isspace()) else text
+    if not user_text:
+        return
+
+    # 危機優先：固定文案直接用 reply token 回
+    if is_crisis(user_text):
+        await _send_reply(event, CRISIS_REPLY)
+        return
+
+    # 快取命中時答案已在手上：直接用 reply token 回，不浪費占位訊息與 push 配額
+    cached = _cache_get((OPENAI_MODEL, _SYSTEM_PROMPT_HASH, user_text))
+    if cached is not None:
+        await _send_reply(event, cached)
+        return
+
+    user_id = getattr(event.source, "user_id", None) if hasattr(event, "source") else None
+    if user_id:
+        # 先占位回覆壓低體感延遲，GPT 串流收完再 push 正式內容
+        try:
+            await asyncio.to_thread(
+                line_bot_api.reply_message,
+                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextSendMessage(text=THINKING_REPLY)]),
+            )
+        except Exception as e:
+            app.logger.error(f"[line thinking reply] {e}")
+        reply_text = await ask_gpt(user_text)
+        try:
+            await _push(user_id, reply_text)
+        except Exception as e:
+            app.logger.error(f"[line] push failed: {e}")
+    else:
+        # 沒有 user_id 可 push（部分群組來源），維持生成完才回
+        reply_text = await ask_gpt(user_text)
+        await _send_reply(event, reply_text)
+
+# -------------------- 本機啟動（雲端用 gunicorn） --------------------
+# 部署：gunicorn -k gthread --threads 32 --workers $(nproc) app:app --timeout 30
+# sync worker 一個 request 佔一個 worker；gthread 讓單一 worker 同時吃 N 個
+# webhook（/callback 只剩驗簽＋解析＋入列，執行緒幾乎立刻歸還）。
+# meinheld 雖更快但已停止維護、無新版 CPython wheel，不列入選項。
+# 進階：全檔型別註記是 AOT 編譯（mypyc）的前置作業；要真的編譯還得先消化
+# 動態 kwargs 展開與第三方 stubs 等 strict-typing 障礙，目前僅屬基礎工程
+# 註：gunicorn_h1c（picohttpparser/SIMD 解析）目前只出了 parser 函式庫，
+# 還沒有可用 -k 掛上的 Worker class；等上游出了 worker 再換掉預設解析器。
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 5000))
+    app.run(host="0.0.0.0", port=port)